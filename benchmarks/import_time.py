@@ -0,0 +1,54 @@
+"""
+Measure how long it takes to import ThunderBoard modules in a fresh interpreter,
+and which heavy dependencies each of them pulls in.
+
+    python benchmarks/import_time.py [-n REPEAT]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+MODULES = [
+    'thunder_board.clients',
+    'thunder_board.objects',
+    'thunder_board.server',
+    'thunder_board.app',
+]
+
+HEAVY_MODULES = ['PIL', 'numpy', 'matplotlib', 'flask', 'flask_socketio']
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE, check=True)
+    return time.perf_counter() - start, result.stdout.decode().strip()
+
+
+def best_of(code, repeat):
+    return min(run(code)[0] for _ in range(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time benchmark of ThunderBoard modules.')
+    parser.add_argument('-n', '--repeat', type=int, default=10, help='Runs per module, the best one is kept.')
+    args = parser.parse_args()
+
+    baseline = best_of('pass', args.repeat)
+    print(f"Interpreter startup: {baseline * 1000:.1f} ms (subtracted below)")
+    print(f"{'module':<26}{'import (ms)':>12}  heavy dependencies loaded")
+
+    for module in MODULES:
+        elapsed = best_of(f'import {module}', args.repeat) - baseline
+        _, loaded = run(f'import sys, {module}; '
+                        f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+        print(f"{module:<26}{elapsed * 1000:>12.1f}  {loaded or '-'}")
+
+
+if __name__ == '__main__':
+    main()
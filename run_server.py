@@ -1,3 +1,4 @@
 import thunder_board.app
 
-thunder_board.app.serve()
+if __name__ == "__main__":
+    thunder_board.app.serve()
@@ -1,10 +1,15 @@
 import io
+import sys
+import array
 import socket
 import struct
 import time
 import threading
 import json
 import logging
+import zlib
+
+from thunder_board.tiles import changed_tiles
 
 
 class BaseClient:
@@ -162,10 +167,24 @@ class ImageClient(BaseClient):
 
 
 class PlotClient(ImageClient):
-    def __init__(self, name, board="", id="", server_host="localhost", server_port=2333, format="png"):
+    def __init__(self, name, board="", id="", server_host="localhost", server_port=2333, format="png",
+                 raw=False, compress_level=1, delta=False, tile_size=64, keyframe_interval=30):
         super().__init__(name, board, id, server_host, server_port, format)
+        # In raw mode, the figure is rendered into the Agg buffer and the pixels are shipped as they are.
+        # `format` is then the format the server will encode the frame into before it goes to the browser.
+        self.raw = raw
+        self.compress_level = compress_level
+        self.delta = delta
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self._last_frame = None
+        self._frames_since_keyframe = 0
 
     def send(self, fig): # fig: 'matplotlib.figure.Figure'
+        if self.raw:
+            self._send_raw(fig)
+            return
+
         image_buffer = io.BytesIO()
         fig.savefig(image_buffer, format=self.format)
         img_data = image_buffer.getbuffer()
@@ -175,6 +194,68 @@ class PlotClient(ImageClient):
 
         self._send_with_metadata(self.metadata, img_data)
 
+    def _get_agg_canvas(self, fig):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        # Reuse the canvas (and the renderer it caches) if the figure is sent repeatedly.
+        if isinstance(fig.canvas, FigureCanvasAgg):
+            return fig.canvas
+        return FigureCanvasAgg(fig)
+
+    def _send_raw(self, fig):
+        import numpy as np
+
+        canvas = self._get_agg_canvas(fig)
+        canvas.draw()
+        frame = np.asarray(canvas.buffer_rgba())
+        height, width = frame.shape[:2]
+
+        metadata = dict(self.metadata)
+        metadata['raw'] = 'rgba'
+        metadata['width'] = width
+        metadata['height'] = height
+        metadata['compress'] = self.compress_level
+
+        is_keyframe = not self.delta \
+            or self._last_frame is None \
+            or self._last_frame.shape != frame.shape \
+            or self._frames_since_keyframe >= self.keyframe_interval
+
+        if is_keyframe:
+            data = frame.tobytes()
+            self._frames_since_keyframe = 0
+        else:
+            tiles = self._changed_tiles(self._last_frame, frame)
+            if not tiles:
+                return
+            data = b"".join(tiles)
+            metadata['delta'] = True
+            metadata['tiles'] = len(tiles)
+            self._frames_since_keyframe += 1
+
+        if self.delta:
+            self._last_frame = frame.copy()
+
+        if self.compress_level:
+            data = zlib.compress(data, self.compress_level)
+
+        self._send_with_metadata(metadata, data)
+
+    def _changed_tiles(self, last_frame, frame):
+        import numpy as np
+
+        height, width = frame.shape[:2]
+        size = self.tile_size
+        changed = changed_tiles(last_frame, frame, size)
+
+        tiles = []
+        for row, col in zip(*np.nonzero(changed)):
+            x, y = int(col) * size, int(row) * size
+            w, h = min(size, width - x), min(size, height - y)
+            tiles.append(struct.pack("HHHH", x, y, w, h) + frame[y:y + h, x:x + w].tobytes())
+
+        return tiles
+
     def sanitize_mpl_svg(self, buf: memoryview):
         line_to_remove = [0, 1, 2, 3, 5, 6, 7, 8, 9]
         current_line = 0
@@ -198,72 +279,281 @@ class DialogClient(BaseClient):
         self.groups_order = [ 'Default' ]
         self.fields = {}
         self.handlers = {}
+        # Fields changed or removed since the last display(). Only those are sent once the dialog is displayed.
+        self.changed_fields = []
+        self.removed_fields = []
+        self.displayed = False
 
     def add_group(self, name=""):
         if name not in self.groups:
             self.groups[name] = []
             self.groups_order.append(name)
 
+    def _set_field(self, name, group, field):
+        if not name in self.fields:
+            self.groups[group].append(name)
+            if name in self.removed_fields:
+                self.removed_fields.remove(name)
+        elif self.fields[name] == field:
+            return
+
+        self.fields[name] = field
+        if name not in self.changed_fields:
+            self.changed_fields.append(name)
+
     def add_button(self, name="", text="", handler=None, group="Default", enabled=True):
         if not name:
             raise ValueError("Name can not be empty.")
 
-        if not name in self.fields:
-            self.groups[group].append(name)
-
-        self.fields[name] = { 'type': 'button',
-                              'text': text,
-                              'enabled': enabled }
+        field = { 'type': 'button',
+                  'text': text,
+                  'enabled': enabled }
         if handler:
-            self.fields[name]['handle'] = 'on_click'
+            field['handle'] = 'on_click'
             self.handlers[name + '@on_click'] = handler
 
+        self._set_field(name, group, field)
+
     def add_input_box(self, name="", label_text="", handler=None, default_value="", group="Default", enabled=True):
         if not name:
             raise ValueError("Name can not be empty.")
 
-        if not name in self.fields:
-            self.groups[group].append(name)
-
-        self.fields[name] = { 'type': 'input',
-                              'text': label_text,
-                              'value': default_value,
-                              'enabled': enabled }
+        field = { 'type': 'input',
+                  'text': label_text,
+                  'value': default_value,
+                  'enabled': enabled }
         if handler:
-            self.fields[name]['handle'] = 'on_change'
+            field['handle'] = 'on_change'
             self.handlers[name + '@on_change'] = handler
 
+        self._set_field(name, group, field)
+
     def add_text_label(self, name="", text="", group="Default"):
         if not name:
             raise ValueError("Name can not be empty.")
 
-        if not name in self.fields:
-            self.groups[group].append(name)
-
-        self.fields[name] = { 'type': 'label',
-                              'text': text }
+        self._set_field(name, group, { 'type': 'label',
+                                       'text': text })
 
     def add_slider(self, name="", label_text="", value_range=None, default_value="", group="Default", enabled=True):
         pass
 
-    def display(self):
-        fields_to_send = []
+    def remove_field(self, name):
+        if name not in self.fields:
+            return
+
+        for group in self.groups.values():
+            if name in group:
+                group.remove(name)
+        del self.fields[name]
+        for event in [event for event in self.handlers if event.startswith(name + '@')]:
+            del self.handlers[event]
+
+        if name in self.changed_fields:
+            self.changed_fields.remove(name)
+        self.removed_fields.append(name)
+
+    def _field_to_send(self, name):
         for group in self.groups_order:
-            fields = self.groups[group]
-            for field in fields:
-                fields_to_send.append(
-                    {
-                        'group': group,
-                        'name': field,
-                        **self.fields[field]
-                    }
-                )
-
-        self._send_with_metadata(self.metadata, bytes(json.dumps(fields_to_send), 'utf-8'))
+            if name in self.groups[group]:
+                return { 'group': group,
+                         'name': name,
+                         **self.fields[name] }
+
+    def display(self, full=False):
+        if not self.displayed or full:
+            fields_to_send = []
+            for group in self.groups_order:
+                fields = self.groups[group]
+                for field in fields:
+                    fields_to_send.append(self._field_to_send(field))
+
+            metadata = self.metadata
+            data = fields_to_send
+        else:
+            if not self.changed_fields and not self.removed_fields:
+                return
+
+            metadata = dict(self.metadata)
+            metadata['patch'] = True
+            data = { 'update': [self._field_to_send(name) for name in self.changed_fields],
+                     'remove': self.removed_fields }
+
+        self._send_with_metadata(metadata, bytes(json.dumps(data), 'utf-8'))
+        self.displayed = True
+        self.changed_fields = []
+        self.removed_fields = []
 
     def message_handler(self, data_dict):
-        event = data_dict['event']
-        args = data_dict['args']
+        # Events from the browser may come in batches.
+        if 'events' in data_dict:
+            events = json.loads(data_dict['events'])
+        else:
+            events = [data_dict]
+
+        for event in events:
+            self.handle_event(event['event'], event['args'])
+
+    def handle_event(self, event, args):
         logging.info(f"Event {event} emitted with args {args}")
+        name, _, handle = event.partition('@')
+        if handle == 'on_change' and name in self.fields:
+            # The browser already shows the new value, keep ours in sync without sending it back.
+            self.fields[name]['value'] = args
+
         if event in self.handlers:
             self.handlers[event](args)
+
+
+class TableClient(BaseClient):
+    # Columns are sent as typed arrays: 'int' (64 bit), 'float' (64 bit) or 'str'.
+    TYPECODES = {'int': 'q', 'float': 'd'}
+
+    def __init__(self, name, columns, key=None, board="", id="", server_host="localhost", server_port=2333):
+        super().__init__(name, board, id, server_host, server_port)
+        self.type = "table"
+        # columns: list of (name, type) pairs, or a dict name -> type.
+        self.columns = list(columns.items()) if isinstance(columns, dict) else [tuple(column) for column in columns]
+        for column_name, column_type in self.columns:
+            if column_type not in ('int', 'float', 'str'):
+                raise ValueError(f"Unknown type {column_type} of column {column_name}.")
+        if key is not None and key not in dict(self.columns):
+            raise ValueError(f"Key {key} is not a column.")
+        self.key = key
+
+    def _to_columns(self, rows):
+        # rows: a list of rows (dicts or sequences in column order), or a dict of columns.
+        if isinstance(rows, dict):
+            return {column_name: list(rows[column_name]) for column_name, _ in self.columns}
+
+        columns = {column_name: [] for column_name, _ in self.columns}
+        for row in rows:
+            if isinstance(row, dict):
+                for column_name, _ in self.columns:
+                    columns[column_name].append(row.get(column_name))
+            else:
+                for (column_name, _), value in zip(self.columns, row):
+                    columns[column_name].append(value)
+
+        return columns
+
+    def _encode_columns(self, columns):
+        header = {'rows': 0, 'columns': []}
+        blobs = []
+        for column_name, column_type in self.columns:
+            values = columns[column_name]
+            header['rows'] = len(values)
+            if column_type == 'str':
+                blob = bytes(json.dumps([None if value is None else str(value) for value in values]), 'utf-8')
+            else:
+                if column_type == 'int':
+                    values = array.array('q', [0 if value is None else int(value) for value in values])
+                else:
+                    values = array.array('d', [float('nan') if value is None else float(value) for value in values])
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                blob = values.tobytes()
+
+            header['columns'].append({'name': column_name, 'dtype': column_type, 'length': len(blob)})
+            blobs.append(blob)
+
+        header = bytes(json.dumps(header), 'utf-8')
+        return struct.pack("<I", len(header)) + header + b"".join(blobs)
+
+    def _send_rows(self, op, rows):
+        metadata = dict(self.metadata)
+        metadata['op'] = op
+        if self.key is not None:
+            metadata['key'] = self.key
+
+        self._send_with_metadata(metadata, self._encode_columns(self._to_columns(rows)))
+
+    def send(self, rows):
+        self.append(rows)
+
+    def append(self, rows):
+        self._send_rows('append', rows)
+
+    def update(self, rows):
+        # Rows whose key already exists are replaced, the others are appended. Requires a key column.
+        if self.key is None:
+            raise ValueError("Updating rows requires a key column.")
+        self._send_rows('update', rows)
+
+    def reset(self, rows=()):
+        self._send_rows('reset', rows)
+
+
+class HistogramClient(BaseClient):
+    # Raw samples are sent to the server, which keeps the bin counts. For a 2D histogram (heatmap),
+    # give bins_y and range_y and add (x, y) points.
+    def __init__(self, name, bins=50, range=(0.0, 1.0), bins_y=None, range_y=None, decay=None, window=None,
+                 batch_size=10000, board="", id="", server_host="localhost", server_port=2333):
+        super().__init__(name, board, id, server_host, server_port)
+        self.type = "histogram"
+        self.dims = 2 if bins_y else 1
+        if self.dims == 2 and range_y is None:
+            raise ValueError("range_y is required for a 2D histogram.")
+        if decay is not None and window is not None:
+            raise ValueError("Use either decay or window, not both.")
+        for _bins in ((bins, bins_y) if self.dims == 2 else (bins,)):
+            if int(_bins) != _bins or _bins < 1:
+                raise ValueError(f"Invalid number of bins {_bins!r}, must be a positive integer.")
+        for _range in ((range, range_y) if self.dims == 2 else (range,)):
+            if len(_range) != 2 or not float(_range[1]) > float(_range[0]):
+                raise ValueError(f"Invalid range {_range!r}, must be (low, high) with high > low.")
+
+        self.metadata['bins'] = int(bins)
+        self.metadata['range'] = "%r,%r" % (float(range[0]), float(range[1]))
+        if self.dims == 2:
+            self.metadata['bins_y'] = int(bins_y)
+            self.metadata['range_y'] = "%r,%r" % (float(range_y[0]), float(range_y[1]))
+        # decay: counts are multiplied by this factor at each batch. window: only the last N batches are counted.
+        if decay is not None:
+            self.metadata['decay'] = decay
+        if window is not None:
+            self.metadata['window'] = window
+
+        self.batch_size = batch_size
+        self.xs = array.array('d')
+        self.ys = array.array('d')
+        self.buffer_lock = threading.Lock()
+
+    def add(self, samples, ys=None):
+        # samples: values for a 1D histogram. For 2D, either (x, y) points, or xs and ys.
+        with self.buffer_lock:
+            if self.dims == 1:
+                self.xs.extend(samples)
+            elif ys is not None:
+                self.xs.extend(samples)
+                self.ys.extend(ys)
+            else:
+                for x, y in samples:
+                    self.xs.append(x)
+                    self.ys.append(y)
+            full = len(self.xs) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.buffer_lock:
+            xs, ys = self.xs, self.ys
+            self.xs, self.ys = array.array('d'), array.array('d')
+
+        if not xs:
+            return
+        if self.dims == 2 and len(xs) != len(ys):
+            raise ValueError("xs and ys must have the same length.")
+
+        if sys.byteorder == 'big':
+            xs.byteswap()
+            ys.byteswap()
+
+        metadata = dict(self.metadata)
+        metadata['count'] = len(xs)
+        self._send_with_metadata(metadata, xs.tobytes() + ys.tobytes())
+
+    def send(self, samples, ys=None):
+        self.add(samples, ys)
+        self.flush()
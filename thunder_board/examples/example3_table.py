@@ -0,0 +1,26 @@
+import time
+import random
+
+from thunder_board.clients import TableClient
+
+# Columns are typed: 'int', 'float' or 'str'. With a key column, update() replaces rows with the same key.
+table = TableClient("Runs", columns=[("run", "int"), ("loss", "float"), ("status", "str")], key="run", board="Table")
+
+losses = {}
+step = 0
+while True:
+    try:
+        # Only the changed rows are sent. Browsers ask the server for the page they show,
+        # sorted and filtered there, so this stays cheap with thousands of rows.
+        runs = range(step * 100, step * 100 + 100)
+        table.append([(run, random.random(), "running") for run in runs])
+
+        finished = random.sample(range((step + 1) * 100), 10)
+        table.update([(run, random.random() / 10, "finished") for run in finished])
+
+        time.sleep(1)
+        step += 1
+
+    except KeyboardInterrupt:
+        table.close()
+        exit()
@@ -0,0 +1,28 @@
+import time
+import random
+
+from thunder_board.clients import HistogramClient
+
+# The server bins the samples and browsers draw the counts, so no figure is rendered here.
+# decay=0.9 makes old samples fade out; use window=N to only count the last N batches instead.
+latency = HistogramClient("Latency", bins=50, range=(0, 200), decay=0.9, board="Histogram")
+# bins_y and range_y make it a 2D histogram, drawn as a heatmap.
+position = HistogramClient("Position", bins=40, range=(-3, 3), bins_y=40, range_y=(-3, 3), window=10,
+                           board="Histogram")
+
+t = 0
+while True:
+    try:
+        for _ in range(1000):
+            latency.add([random.gammavariate(2, 10 + t % 30)])
+        latency.flush()
+
+        position.send([(random.gauss(0, 1), random.gauss(0, 0.5 + (t % 10) / 10)) for _ in range(5000)])
+
+        time.sleep(1)
+        t += 1
+
+    except KeyboardInterrupt:
+        latency.close()
+        position.close()
+        exit()
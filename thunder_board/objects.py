@@ -4,11 +4,19 @@ import logging
 import time
 import json
 import threading
+import struct
+import zlib
+import collections
 
-from PIL import Image
+from thunder_board import registry
+from thunder_board.tiles import changed_tiles
+
+# PIL and NumPy are imported where they are used, so that importing this module stays cheap.
 
 class BaseObject:
     type = "base"
+    # Whether a newer update makes the older ones still waiting to be sent useless.
+    replaceable = True
 
     def __init__(self, name, board, send_enable=False):
         self.name = name
@@ -18,6 +26,7 @@ class BaseObject:
         self.active = True
         self.send_enable = send_enable
         self.socket = None
+        self.lock = threading.RLock()
 
     @staticmethod
     def init(name, board):
@@ -30,6 +39,19 @@ class BaseObject:
     def dump_to(self, to_send):
         return to_send
 
+    # Used when a browser has no previous state of this object, e.g. it just subscribed.
+    # Objects that send deltas in dump_to() need to override this and dump their full state.
+    def dump_keyframe_to(self, to_send):
+        return self.dump_to(to_send)
+
+    # Used for browsers that can't keep up. Higher level means the browser is slower.
+    def dump_reduced_to(self, to_send, level):
+        return self.dump_keyframe_to(to_send)
+
+    # Answer a request of one browser about this object, e.g. a page of a table. None if not supported.
+    def query(self, request):
+        return None
+
 
 class TextObject(BaseObject):
     type = "text"
@@ -50,6 +72,8 @@ class TextObject(BaseObject):
             self.rotate = True
         else:
             self.rotate = False
+        # Each update of a rotating text is a new line, none of them can be skipped.
+        self.replaceable = not self.rotate
 
         self.text = text_data.decode('utf-8')
         logging.debug(f"ver {self.version}: {self.text}")
@@ -68,38 +92,198 @@ class ImageObject(BaseObject):
     type = "image"
 
     IMAGE_MAX_SIZE = (650, 650)
+    DELTA_FORMATS = ("png", "jpeg", "jpg", "webp")
+    TILE_SIZE = 64
+    KEYFRAME_INTERVAL = 100
+    KEYFRAME_CHANGED_RATIO = 0.5
 
     def __init__(self, name, board):
         super().__init__(name, board)
         self.image = None
         self.format = "jpeg"
+        self.frame = None
+        self.require_compress = False
+        self.pixels = None
+        self.tiles = None
+        self.frames_since_keyframe = 0
+        self.encoded_version = 0
+        self.reduced_image = None
+        self.reduced_key = None
 
     @staticmethod
     def init(name, board):
         return ImageObject(name, board)
 
     def update(self, metadata, image):
+        from PIL import Image
+
+        self.require_compress = 'require_compress' in metadata and metadata['require_compress'] == 'True'
+
+        if metadata.get('raw') == 'rgba':
+            if not self.update_raw_frame(metadata, image):
+                return
+            self.version += 1
+            self.format = metadata['format'] if metadata['format'] in self.DELTA_FORMATS else "png"
+            self.update_tiles(self.display_frame(self.frame))
+            return
+
         self.version += 1
         self.format = metadata['format']
+        self.frame = None
         if self.format != "svg":
-            if 'require_compress' in metadata and metadata['require_compress'] == 'True':
+            if self.require_compress:
                 logging.debug("Image requires compressing")
                 im = Image.open(io.BytesIO(image))
-                im.thumbnail(self.IMAGE_MAX_SIZE, Image.ANTIALIAS)
+                im.thumbnail(self.IMAGE_MAX_SIZE, Image.LANCZOS)
                 buffer = io.BytesIO()
                 im = im.convert("RGB")
                 im.save(buffer, format="JPEG", dpi=[100, 100], quality=90)
                 self.image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                self.format = "jpeg"
+                self.update_tiles(im)
             else:
                 self.image = base64.b64encode(image).decode('utf-8')
+                if self.format in self.DELTA_FORMATS:
+                    self.update_tiles(Image.open(io.BytesIO(image)))
+                else:
+                    self.reset_tiles()
         else:
             self.image = image.decode('utf-8').strip()
+            self.reset_tiles()
+
+        self.encoded_version = self.version
+
+    def update_raw_frame(self, metadata, data):
+        from PIL import Image
+
+        size = (int(metadata['width']), int(metadata['height']))
+        if metadata.get('compress', '0') != '0':
+            data = zlib.decompress(data)
+
+        if metadata.get('delta') != 'True':
+            self.frame = Image.frombuffer("RGBA", size, data, "raw", "RGBA", 0, 1).copy()
+            return True
+
+        if self.frame is None or self.frame.size != size:
+            logging.debug(f"Delta frame of {self.name} dropped, waiting for the next keyframe")
+            return False
+
+        offset = 0
+        for _ in range(int(metadata['tiles'])):
+            x, y, w, h = struct.unpack_from("HHHH", data, offset)
+            offset += 8
+            tile = Image.frombuffer("RGBA", (w, h), data[offset:offset + w * h * 4], "raw", "RGBA", 0, 1)
+            self.frame.paste(tile, (x, y))
+            offset += w * h * 4
+
+        return True
+
+    def display_frame(self, frame):
+        from PIL import Image
+
+        if self.require_compress:
+            frame = frame.copy()
+            frame.thumbnail(self.IMAGE_MAX_SIZE, Image.LANCZOS)
+        return frame
+
+    def encode_frame(self, frame, format):
+        buffer = io.BytesIO()
+        if format in ("jpeg", "jpg"):
+            frame.convert("RGB").save(buffer, format="JPEG", quality=90)
+        elif format == "webp":
+            frame.save(buffer, format="WEBP", quality=90)
+        else:
+            frame.save(buffer, format="PNG", compress_level=1)
+        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+    def reset_tiles(self):
+        self.pixels = None
+        self.tiles = None
+        self.frames_since_keyframe = 0
+
+    def update_tiles(self, frame):
+        import numpy as np
+        from PIL import Image
+
+        # Diff the frame against the previous one in fixed tiles, so browsers that have the
+        # previous version only need the changed regions.
+        pixels = np.asarray(frame.convert("RGBA"))
+        last_pixels, self.pixels = self.pixels, pixels
+        self.tiles = None
+
+        if last_pixels is None or last_pixels.shape != pixels.shape \
+                or self.frames_since_keyframe >= self.KEYFRAME_INTERVAL:
+            self.frames_since_keyframe = 0
+            return
+
+        height, width = pixels.shape[:2]
+        size = self.TILE_SIZE
+        changed = changed_tiles(last_pixels, pixels, size)
+        rows, cols = changed.shape
+
+        if changed.sum() > self.KEYFRAME_CHANGED_RATIO * rows * cols:
+            self.frames_since_keyframe = 0
+            return
+
+        tiles = []
+        for row in range(rows):
+            col = 0
+            while col < cols:
+                if not changed[row, col]:
+                    col += 1
+                    continue
+                # Merge horizontally adjacent changed tiles into one rectangle.
+                end = col
+                while end + 1 < cols and changed[row, end + 1]:
+                    end += 1
+                x, y = col * size, row * size
+                w, h = min((end + 1) * size, width) - x, min(size, height - y)
+                tiles.append({
+                    'x': x, 'y': y, 'w': w, 'h': h,
+                    'data': self.encode_frame(Image.fromarray(pixels[y:y + h, x:x + w]), "png")
+                })
+                col = end + 1
+
+        self.tiles = tiles
+        self.frames_since_keyframe += 1
 
     def dump_to(self, dump_to):
+        if self.tiles is None:
+            return self.dump_keyframe_to(dump_to)
+
+        dump_to['tiles'] = self.tiles
+        dump_to['base_version'] = self.version - 1
+        dump_to['format'] = self.format
+        return dump_to
+
+    def dump_keyframe_to(self, dump_to):
+        if self.encoded_version != self.version:
+            # Frames received as raw pixels are only encoded when a browser needs the whole image.
+            self.image = self.encode_frame(self.display_frame(self.frame), self.format)
+            self.encoded_version = self.version
+
         dump_to['data'] = self.image
         dump_to['format'] = self.format
         return dump_to
 
+    def dump_reduced_to(self, dump_to, level):
+        from PIL import Image
+
+        if self.pixels is None:
+            return self.dump_keyframe_to(dump_to)
+
+        if self.reduced_key != (self.version, level):
+            frame = Image.fromarray(self.pixels)
+            height, width = self.pixels.shape[:2]
+            frame.thumbnail((max(1, width >> level), max(1, height >> level)), Image.LANCZOS)
+            self.reduced_image = self.encode_frame(frame, "jpeg")
+            self.reduced_key = (self.version, level)
+
+        dump_to['data'] = self.reduced_image
+        dump_to['format'] = "jpeg"
+        dump_to['reduced'] = level
+        return dump_to
+
 
 class DialogObject(BaseObject):
     type = 'dialog'
@@ -107,6 +291,7 @@ class DialogObject(BaseObject):
     def __init__(self, name, board):
         super().__init__(name, board, send_enable=True)
         self.fields = []
+        self.patch = None
 
     @staticmethod
     def init(name, board):
@@ -114,16 +299,364 @@ class DialogObject(BaseObject):
 
     def update(self, metadata, data):
         self.version += 1
-        self.fields = json.loads(data)
+        if metadata.get('patch') == 'True':
+            self.patch = json.loads(data)
+            self.apply_patch(self.patch)
+        else:
+            self.patch = None
+            self.fields = json.loads(data)
+
+    def apply_patch(self, patch):
+        removed = set(patch['remove'])
+        fields = [field for field in self.fields if field['name'] not in removed]
+        index = {field['name']: i for i, field in enumerate(fields)}
+
+        for field in patch['update']:
+            if field['name'] in index:
+                fields[index[field['name']]] = field
+                continue
+
+            # New fields go after the last field of their group, or at the end for a new group.
+            position = len(fields)
+            for i, existing in enumerate(fields):
+                if existing['group'] == field['group']:
+                    position = i + 1
+            fields.insert(position, field)
+            index = {field['name']: i for i, field in enumerate(fields)}
+
+        self.fields = fields
 
     def dump_to(self, dump_to):
+        if self.patch is None:
+            return self.dump_keyframe_to(dump_to)
+
+        dump_to['patch'] = self.patch
+        dump_to['base_version'] = self.version - 1
+        return dump_to
+
+    def dump_keyframe_to(self, dump_to):
         dump_to['fields'] = self.fields
         return dump_to
 
 
+class TableObject(BaseObject):
+    type = 'table'
+
+    DTYPES = {'int': '<i8', 'float': '<f8', 'str': object}
+    MAX_PAGE_SIZE = 500
+    FILTER_OPS = {
+        '=': lambda column, value: column == value,
+        '!=': lambda column, value: column != value,
+        '<': lambda column, value: column < value,
+        '<=': lambda column, value: column <= value,
+        '>': lambda column, value: column > value,
+        '>=': lambda column, value: column >= value,
+    }
+
+    def __init__(self, name, board):
+        super().__init__(name, board)
+        self.columns = []
+        self.data = {}
+        self.key = None
+        self.key_index = {}
+        self.length = 0
+        self.capacity = 0
+        self.view_cache = None
+
+    @staticmethod
+    def init(name, board):
+        return TableObject(name, board)
+
+    @staticmethod
+    def decode_columns(data):
+        import numpy as np
+
+        header_length, = struct.unpack_from("<I", data, 0)
+        header = json.loads(data[4:4 + header_length])
+        offset = 4 + header_length
+
+        columns = []
+        values = {}
+        for column in header['columns']:
+            blob = data[offset:offset + column['length']]
+            offset += column['length']
+            if column['dtype'] == 'str':
+                values[column['name']] = np.array(json.loads(blob), dtype=object)
+            else:
+                values[column['name']] = np.frombuffer(blob, dtype=TableObject.DTYPES[column['dtype']])
+            columns.append({'name': column['name'], 'dtype': column['dtype']})
+
+        return columns, values, header['rows']
+
+    def reserve(self, length):
+        import numpy as np
+
+        if length <= self.capacity:
+            return
+
+        # Grow geometrically so that appending rows one batch at a time stays linear.
+        self.capacity = max(length, self.capacity * 2, 64)
+        for column in self.columns:
+            grown = np.empty(self.capacity, dtype=self.DTYPES[column['dtype']])
+            grown[:self.length] = self.data[column['name']][:self.length]
+            self.data[column['name']] = grown
+
+    def reset(self, columns, key):
+        import numpy as np
+
+        self.columns = columns
+        self.key = key
+        self.data = {column['name']: np.empty(0, dtype=self.DTYPES[column['dtype']]) for column in columns}
+        self.key_index = {}
+        self.length = 0
+        self.capacity = 0
+
+    def update(self, metadata, data):
+        import numpy as np
+
+        columns, values, rows = self.decode_columns(data)
+        key = metadata.get('key') or None
+
+        if metadata.get('op') == 'reset' or columns != self.columns or key != self.key:
+            self.reset(columns, key)
+
+        if self.key is None or metadata.get('op') == 'append':
+            positions = np.arange(self.length, self.length + rows)
+        else:
+            # Rows whose key is already in the table are updated in place, the others are appended.
+            positions = np.empty(rows, dtype=np.int64)
+            next_row = self.length
+            for i, key_value in enumerate(values[self.key].tolist()):
+                if key_value not in self.key_index:
+                    self.key_index[key_value] = next_row
+                    next_row += 1
+                positions[i] = self.key_index[key_value]
+
+        self.reserve(int(positions.max()) + 1 if rows else 0)
+        for column in self.columns:
+            self.data[column['name']][positions] = values[column['name']]
+
+        if self.key is not None and metadata.get('op') == 'append':
+            for i, key_value in enumerate(values[self.key].tolist()):
+                self.key_index[key_value] = self.length + i
+
+        self.length = max(self.length, int(positions.max()) + 1 if rows else 0)
+        self.version += 1
+
+    def dump_to(self, dump_to):
+        dump_to['columns'] = self.columns
+        dump_to['key'] = self.key
+        dump_to['rows'] = self.length
+        return dump_to
+
+    def view(self, sort, descending, filters):
+        import numpy as np
+
+        # Several browsers usually look at the same view, keep the last one.
+        cache_key = (self.version, sort, descending, json.dumps(filters, sort_keys=True))
+        if self.view_cache is not None and self.view_cache[0] == cache_key:
+            return self.view_cache[1]
+
+        indices = np.arange(self.length)
+        for _filter in filters:
+            column = self.data[_filter['column']][:self.length][indices]
+            dtype = next(c['dtype'] for c in self.columns if c['name'] == _filter['column'])
+            if dtype == 'str':
+                # Empty cells never match a filter, and can't be compared with a string anyway.
+                present = np.array([value is not None for value in column], dtype=bool)
+                indices, column = indices[present], column[present]
+
+            if _filter['op'] == 'contains':
+                needle = str(_filter['value']).lower()
+                mask = np.array([needle in str(value).lower() for value in column], dtype=bool)
+            else:
+                value = str(_filter['value']) if dtype == 'str' else float(_filter['value'])
+                mask = np.asarray(self.FILTER_OPS[_filter['op']](column, value), dtype=bool)
+            indices = indices[mask]
+
+        if sort is not None:
+            column = self.data[sort][:self.length][indices]
+            # Empty cells go last whichever the direction, like they are left out by filters.
+            if column.dtype == object:
+                present = np.array([value is not None for value in column], dtype=bool)
+                column = column[present].astype(str)
+            else:
+                present = ~np.isnan(column) if column.dtype.kind == 'f' else np.ones(len(column), dtype=bool)
+                column = column[present]
+            order = np.argsort(column, kind='stable')
+            if descending:
+                order = order[::-1]
+            indices = np.concatenate([indices[present][order], indices[~present]])
+
+        self.view_cache = (cache_key, indices)
+        return indices
+
+    def query(self, request):
+        names = [column['name'] for column in self.columns]
+        sort = request.get('sort') if request.get('sort') in names else None
+        filters = request.get('filters', [])
+        # The query comes from the browser, don't trust its shape.
+        if not isinstance(filters, list) or not all(isinstance(_filter, dict) for _filter in filters):
+            return {'error': 'Invalid query.'}
+        filters = [_filter for _filter in filters
+                   if _filter.get('column') in names and _filter.get('op') in ('contains', *self.FILTER_OPS)]
+        try:
+            page_size = max(1, min(int(request.get('page_size', 50)), self.MAX_PAGE_SIZE))
+            page = int(request.get('page', 0))
+            indices = self.view(sort, bool(request.get('descending')), filters)
+        except (ValueError, TypeError, KeyError):
+            return {'error': 'Invalid query.'}
+
+        pages = max(1, (len(indices) + page_size - 1) // page_size)
+        page = max(0, min(page, pages - 1))
+        selected = indices[page * page_size:(page + 1) * page_size]
+
+        rows = [[] for _ in selected]
+        for name in names:
+            for row, value in zip(rows, self.data[name][selected].tolist()):
+                # NaN is not valid JSON.
+                row.append(None if isinstance(value, float) and value != value else value)
+
+        return {
+            'version': self.version,
+            'total': len(indices),
+            'page': page,
+            'pages': pages,
+            'page_size': page_size,
+            'rows': rows,
+        }
+
+
+class HistogramObject(BaseObject):
+    type = 'histogram'
+
+    def __init__(self, name, board):
+        super().__init__(name, board)
+        self.config = None
+        self.config_metadata = None
+        self.counts = None
+        self.batches = collections.deque()
+        self.total = 0
+        self.outside = 0
+
+    @staticmethod
+    def init(name, board):
+        return HistogramObject(name, board)
+
+    @staticmethod
+    def parse_range(value):
+        low, high = (float(bound) for bound in value.split(","))
+        if not high > low:
+            raise ValueError(f"Invalid histogram range {value}.")
+        return low, high
+
+    def reset(self, metadata):
+        import numpy as np
+
+        bins = [int(metadata['bins'])]
+        ranges = [self.parse_range(metadata['range'])]
+        if 'bins_y' in metadata:
+            bins.append(int(metadata['bins_y']))
+            ranges.append(self.parse_range(metadata['range_y']))
+        if min(bins) < 1:
+            raise ValueError(f"Invalid number of histogram bins {bins}.")
+
+        self.config = {
+            'bins': bins,
+            'ranges': ranges,
+            'decay': float(metadata['decay']) if 'decay' in metadata else None,
+            'window': int(metadata['window']) if 'window' in metadata else None,
+        }
+        self.counts = np.zeros(bins, dtype=np.float64)
+        self.batches.clear()
+        self.total = 0
+        self.outside = 0
+
+    def bin_counts(self, samples):
+        import numpy as np
+
+        # Equal-width bins, so a sample's bin is a multiplication away. Much cheaper than np.histogram.
+        inside = np.ones(len(samples[0]), dtype=bool)
+        indices = []
+        for values, bins, (low, high) in zip(samples, self.config['bins'], self.config['ranges']):
+            index = np.floor((values - low) * (bins / (high - low)))
+            index[values == high] = bins - 1
+            inside &= (index >= 0) & (index < bins)
+            indices.append(index)
+
+        flat = np.zeros(int(inside.sum()), dtype=np.int64)
+        for index, bins in zip(indices, self.config['bins']):
+            flat = flat * bins + index[inside].astype(np.int64)
+
+        size = int(np.prod(self.config['bins']))
+        counts = np.bincount(flat, minlength=size).reshape(self.config['bins'])
+        return counts, len(inside) - len(flat)
+
+    def update(self, metadata, data):
+        import numpy as np
+
+        config_keys = ('bins', 'range', 'bins_y', 'range_y', 'decay', 'window')
+        config = tuple(metadata.get(key) for key in config_keys)
+        if self.config is None or config != self.config_metadata:
+            self.reset(metadata)
+            self.config_metadata = config
+
+        count = int(metadata['count'])
+        values = np.frombuffer(data, dtype='<f8')
+        samples = [values[i * count:(i + 1) * count] for i in range(len(self.config['bins']))]
+        counts, outside = self.bin_counts(samples)
+
+        if self.config['decay'] is not None:
+            self.counts *= self.config['decay']
+            self.total *= self.config['decay']
+            self.outside *= self.config['decay']
+        elif self.config['window'] is not None:
+            self.batches.append((counts, count, outside))
+            if len(self.batches) > self.config['window']:
+                old_counts, old_count, old_outside = self.batches.popleft()
+                self.counts -= old_counts
+                self.total -= old_count
+                self.outside -= old_outside
+
+        self.counts += counts
+        self.total += count
+        self.outside += outside
+        self.version += 1
+
+    def dump_to(self, dump_to):
+        if self.config is None:
+            # Nothing received yet, or the first batch was rejected.
+            dump_to['bins'] = []
+            dump_to['ranges'] = []
+            dump_to['counts'] = []
+            dump_to['total'] = 0
+            dump_to['outside'] = 0
+            return dump_to
+
+        dump_to['bins'] = self.config['bins']
+        dump_to['ranges'] = self.config['ranges']
+        dump_to['counts'] = self.counts.tolist()
+        dump_to['total'] = self.total
+        dump_to['outside'] = self.outside
+        return dump_to
+
+
+
+
+BUILTIN_OBJECT_TYPES = [
+    registry.ObjectType('text', TextObject.init),
+    # Decoding, diffing and encoding frames is heavy, don't hold the receiving thread for it.
+    registry.ObjectType('image', ImageObject.init, processing=registry.THREAD_POOL),
+    registry.ObjectType('dialog', DialogObject.init),
+    registry.ObjectType('table', TableObject.init, processing=registry.THREAD_POOL),
+    registry.ObjectType('histogram', HistogramObject.init, processing=registry.THREAD_POOL),
+]
 
 
 def register_object_types(server):
-    server.object_create_handlers['text'] = TextObject.init
-    server.object_create_handlers['image'] = ImageObject.init
-    server.object_create_handlers['dialog'] = DialogObject.init
+    for object_type in BUILTIN_OBJECT_TYPES:
+        server.register_object_type(object_type)
+
+    for object_type in registry.load_plugins():
+        logging.info(f"Register object type {object_type.type} from plugin")
+        server.register_object_type(object_type)
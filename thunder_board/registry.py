@@ -0,0 +1,78 @@
+import logging
+
+# Where the updates of an object type are processed.
+#  INLINE: in the thread receiving data from the client. Fine for cheap updates like text.
+#  THREAD_POOL: in the server's worker threads, so the receiving thread can go on reading.
+#  PROCESS_POOL: the decoder runs in a worker process, for CPU-heavy pure-Python work that would
+#                otherwise hold the GIL and slow down everything else.
+INLINE = "inline"
+THREAD_POOL = "thread"
+PROCESS_POOL = "process"
+
+ENTRY_POINT_GROUP = "thunder_board.object_types"
+
+
+class ObjectType:
+    def __init__(self, type, factory, processing=INLINE, decoder=None, renderer=None):
+        """
+        :param type: name of the type, as sent by clients in the `Type` metadata.
+        :param factory: callable(name, board) returning a new object of this type.
+        :param processing: INLINE, THREAD_POOL or PROCESS_POOL.
+        :param decoder: optional callable(metadata, data) turning the bytes received from the client into
+            what the object's update() accepts. With PROCESS_POOL, it must be picklable (a module-level
+            function) and so must be its return value. Worker processes are started fresh, not forked,
+            so the decoder's module must be importable on its own, without relying on state set up by
+            the server.
+        :param renderer: optional path to a JavaScript file that calls registerRenderer(type, {init, update})
+            in the browser.
+        """
+        if processing not in (INLINE, THREAD_POOL, PROCESS_POOL):
+            raise ValueError(f"Unknown processing class {processing}.")
+        if processing == PROCESS_POOL and decoder is None:
+            raise ValueError("Object types processed in the process pool need a decoder.")
+
+        self.type = type
+        self.factory = factory
+        self.processing = processing
+        self.decoder = decoder
+        self.renderer = renderer
+
+
+def iter_entry_points(group=ENTRY_POINT_GROUP):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        try:
+            import pkg_resources
+        except ImportError:
+            return []
+        return list(pkg_resources.iter_entry_points(group))
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=group))
+    return list(eps.get(group, []))
+
+
+def load_plugins(group=ENTRY_POINT_GROUP):
+    """
+    Object types provided by installed packages. An entry point may refer to an ObjectType,
+    or to a callable returning one or a list of them.
+    """
+    object_types = []
+    for entry_point in iter_entry_points(group):
+        try:
+            loaded = entry_point.load()
+            if callable(loaded) and not isinstance(loaded, ObjectType):
+                loaded = loaded()
+            if isinstance(loaded, ObjectType):
+                loaded = [loaded]
+
+            for object_type in loaded:
+                if not isinstance(object_type, ObjectType):
+                    raise TypeError(f"{object_type!r} is not an ObjectType")
+                object_types.append(object_type)
+        except Exception:
+            logging.exception(f"Failed to load object type plugin {entry_point.name}.")
+
+    return object_types
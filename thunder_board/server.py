@@ -1,26 +1,43 @@
 import io
+import os
 import threading
 import socket
 import struct
 import logging
 import time
-
-from flask import Flask, render_template
-from flask_socketio import SocketIO, emit, join_room, leave_room
+import json
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 from thunder_board import objects
+from thunder_board import registry
+from thunder_board.sessions import BrowserSession
 
 
 class DashboardServer:
+    # Updates of one object waiting for a worker. Past this, the receiving thread stops reading from the
+    # client, so that TCP slows the client down instead of the server buffering without limit.
+    MAX_PENDING_UPDATES = 8
+
     def __init__(self, recv_server_host = "0.0.0.0", recv_server_port = 2333, web_server_host = "0.0.0.0", web_server_port = 2334):
         self.recv_server_host = recv_server_host
         self.recv_server_port = recv_server_port
         self.web_server_host = web_server_host
         self.web_server_port = web_server_port
         self.object_create_handlers = {}
+        self.object_types = {}
         self.objects = {}
         self.clients = []
         self.object_subscriptions = {}
+        self.sessions = {}
+        self.thread_pool = ThreadPoolExecutor(thread_name_prefix="Worker")
+        self.process_pool = None
+        self.pending_updates = {}
+        self.pending_updates_condition = threading.Condition()
+
+    def register_object_type(self, object_type):
+        self.object_types[object_type.type] = object_type
+        self.object_create_handlers[object_type.type] = object_type.factory
 
     def serve(self):
         logging.info(f"Initializing data-receiving server at {self.recv_server_host}:{self.recv_server_port} "
@@ -38,6 +55,9 @@ class DashboardServer:
 
     # This function need to run in main thread. This required by Flask.
     def run_web_server(self):
+        from flask import Flask
+        from flask_socketio import SocketIO
+
         self.flask_app = Flask(__name__)
         #self.flask_app.config['DEBUG'] = True
         self.flask_app.config['TEMPLATES_AUTO_RELOAD'] = True
@@ -66,6 +86,32 @@ class DashboardServer:
             else:
                 sent_len += chunk_len
 
+    # Messages to clients are "key=value" lines, prefixed by their length.
+    def encode_message(self, message):
+        dict_str = ""
+        for key, value in message.items():
+            dict_str += f"{key}={value}\n"
+
+        data = bytes(dict_str, 'utf-8')
+        data_len = struct.pack("h", len(data))
+
+        return data_len + data
+
+    # Pack events from the browser into as few messages as the length field allows.
+    def batch_events(self, events):
+        max_length = 32767 - len("events=[]\n")
+        batches = [[]]
+        length = 0
+        for event in events:
+            event_length = len(bytes(json.dumps(event), 'utf-8')) + 2
+            if batches[-1] and length + event_length > max_length:
+                batches.append([])
+                length = 0
+            batches[-1].append(event)
+            length += event_length
+
+        return [{'events': json.dumps(batch)} for batch in batches if batch]
+
     def maintain_connection(self, conn, addr):
         id = None
         while True:
@@ -117,7 +163,8 @@ class DashboardServer:
                             self.socketio.close_room(id)
                             return
                     elif control_msg == "DATA":
-                        self.objects[id].update(metadata, data.tobytes())
+                        self.process_update(id, metadata, data.tobytes())
+                        continue
                 else:
                     if control_msg == "DATA":
                         logging.info("Create object %s" % id)
@@ -128,7 +175,8 @@ class DashboardServer:
                         self.objects[id].socket = conn
                         self.object_subscriptions[id] = []
                         self.send_new_object_notification(id)
-                        self.objects[id].update(metadata, data.tobytes())
+                        self.process_update(id, metadata, data.tobytes())
+                        continue
                     else:
                         continue
 
@@ -144,6 +192,66 @@ class DashboardServer:
                 return
 
 
+    def process_update(self, id, metadata, data):
+        object_type = self.object_types.get(self.objects[id].type)
+        if object_type is None or object_type.processing == registry.INLINE:
+            self.apply_update(id, metadata, data)
+            return
+
+        # Updates of one object must be applied in order, so each object has its own queue,
+        # drained by one worker at a time.
+        with self.pending_updates_condition:
+            while len(self.pending_updates.get(id, ())) >= self.MAX_PENDING_UPDATES:
+                self.pending_updates_condition.wait()
+
+            if id in self.pending_updates:
+                self.pending_updates[id].append((metadata, data))
+                return
+            self.pending_updates[id] = collections.deque([(metadata, data)])
+
+        self.thread_pool.submit(self.drain_updates, id)
+
+    def drain_updates(self, id):
+        with self.pending_updates_condition:
+            metadata, data = self.pending_updates[id].popleft()
+            self.pending_updates_condition.notify_all()
+
+        try:
+            self.apply_update(id, metadata, data)
+        except Exception:
+            logging.exception(f"Failed to process update of {id}.")
+
+        # One update per turn, then go to the back of the pool's queue, so that a busy object doesn't
+        # hold a worker forever while other objects wait for one.
+        with self.pending_updates_condition:
+            if not self.pending_updates[id]:
+                del self.pending_updates[id]
+                return
+        self.thread_pool.submit(self.drain_updates, id)
+
+    def apply_update(self, id, metadata, data):
+        object = self.objects.get(id)
+        if object is None:
+            return
+
+        object_type = self.object_types.get(object.type)
+        if object_type is not None and object_type.decoder is not None:
+            if object_type.processing == registry.PROCESS_POOL:
+                with self.pending_updates_condition:
+                    if self.process_pool is None:
+                        import multiprocessing
+                        from concurrent.futures import ProcessPoolExecutor
+                        # Forking this multi-threaded process could copy locks held by other threads
+                        # into the children, and deadlock them.
+                        self.process_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+                data = self.process_pool.submit(object_type.decoder, metadata, data).result()
+            else:
+                data = object_type.decoder(metadata, data)
+
+        with object.lock:
+            object.update(metadata, data)
+        self.send_update(id)
+
     def wait_check_alive(self, id):
         time.sleep(5)
         if time.time() - self.objects[id].last_active > 4:
@@ -164,10 +272,9 @@ class DashboardServer:
 
         self.recv_socket.close()
 
-    def send_update(self, object_id):
-        if object_id in self.object_subscriptions and self.object_subscriptions[object_id]:
-            object = self.objects[object_id]
-            logging.debug(f"Send updated data ver {object.version} of {object.name}")
+    def dump_object(self, object_id, keyframe=False, level=0):
+        object = self.objects[object_id]
+        with object.lock:
             to_send = {
                 'id': object_id,
                 'type': object.type,
@@ -176,19 +283,57 @@ class DashboardServer:
                 'name': object.name,
                 'active': object.active
             }
-            object.dump_to(to_send)
-            self.socketio.emit('update', to_send, room=object_id)
+            if level:
+                object.dump_reduced_to(to_send, level)
+            elif keyframe:
+                object.dump_keyframe_to(to_send)
+            else:
+                object.dump_to(to_send)
+        return to_send
+
+    # Updates are not emitted directly. Each browser has its own queue, so that a slow one doesn't hold
+    # all the frames it can't receive in memory.
+    def send_update(self, object_id):
+        sessions = [session for session in list(self.sessions.values()) if object_id in session.subscriptions]
+        if sessions and object_id in self.objects:
+            to_send = self.dump_object(object_id)
+            replaceable = self.objects[object_id].replaceable
+            logging.debug(f"Send updated data ver {to_send['version']} of {to_send['name']}")
+            for session in sessions:
+                session.enqueue(object_id, to_send, replaceable)
+
+    # Must be called from a socketio event handler. Only the browser that triggered the event receives the keyframe.
+    def send_keyframe(self, object_id):
+        from flask import request
+
+        if request.sid in self.sessions:
+            logging.debug(f"Send keyframe of {object_id} to client {self.sessions[request.sid].client_id}")
+            self.sessions[request.sid].enqueue_keyframe(object_id)
 
     def send_new_object_notification(self, obj_id):
         self.socketio.emit('new object available', obj_id)
 
     def register_web_server_methods(self, app, socketio):
+        from flask import render_template, request, jsonify, send_file, abort
+        from flask_socketio import emit, join_room, leave_room
+
         # I don't know if there's any other elegant way of doing this.
         # Flask suggests I create apps at module level but this certainly doesn't fit our use case.
 
         @app.route("/", methods=['GET'])
         def index():
-            return render_template('index.html')
+            renderers = [object_type.type for object_type in self.object_types.values() if object_type.renderer]
+            return render_template('index.html', renderers=renderers)
+
+        @app.route("/renderers/<type>.js", methods=['GET'])
+        def renderer(type):
+            if type not in self.object_types or not self.object_types[type].renderer:
+                abort(404)
+            return send_file(os.path.abspath(self.object_types[type].renderer), mimetype="application/javascript")
+
+        @app.route("/stats", methods=['GET'])
+        def stats():
+            return jsonify({sid: session.stats() for sid, session in dict(self.sessions).items()})
 
         @socketio.on('join')
         def join():
@@ -198,18 +343,49 @@ class DashboardServer:
 
             logging.debug(f"Client {id} joined.")
             self.clients.append(id)
+            session = BrowserSession(request.sid, id)
             for obj_id, object in self.objects.items():
                 join_room(obj_id)
                 self.object_subscriptions[obj_id].append(id)
+                session.subscriptions.add(obj_id)
 
+            self.sessions[request.sid] = session
+            socketio.start_background_task(session.run, self)
             emit("id assigned", id)
 
+        @socketio.on('disconnect')
+        def disconnect(*args):
+            session = self.sessions.pop(request.sid, None)
+            if session:
+                logging.debug(f"Client {session.client_id} disconnected.")
+                session.close()
+
         @socketio.on('subscribe')
         def subscribe(json):
             if json['obj_id'] in self.objects:
                 self.object_subscriptions[json['obj_id']].append(json['client_id'])
                 join_room(json['obj_id'])
-                self.send_update(json['obj_id'])
+                if request.sid in self.sessions:
+                    self.sessions[request.sid].subscriptions.add(json['obj_id'])
+                self.send_keyframe(json['obj_id'])
+
+        @socketio.on('keyframe')
+        def keyframe(json):
+            if json['obj_id'] in self.objects:
+                self.send_keyframe(json['obj_id'])
+
+        @socketio.on('query')
+        def query(message):
+            object = self.objects.get(message['obj_id'])
+            if object is None:
+                return
+
+            with object.lock:
+                result = object.query(message)
+            if result is not None:
+                result['id'] = message['obj_id']
+                result['request'] = message.get('request')
+                emit('query result', result)
 
         @socketio.on('list')
         def list(json):
@@ -220,21 +396,18 @@ class DashboardServer:
             emit("list", obj_list)
 
         @socketio.on('send')
-        def send(json):
-            logging.info(f"Receive message from browser client, refer to {json['obj_id']}")
-            if json['obj_id'] in self.objects and self.objects[json['obj_id']].send_enable:
-                dict_str = ""
-                for key, value in json.items():
-                    if key != 'obj_id':
-                        dict_str += f"{key}={value}\n"
-
-                data = bytes(dict_str, 'utf-8')
-                data_len = struct.pack("h", len(data))
-
-                to_be_sent = data_len + data
+        def send(message):
+            obj_id = message['obj_id']
+            logging.info(f"Receive message from browser client, refer to {obj_id}")
+            if obj_id in self.objects and self.objects[obj_id].send_enable:
+                if 'events' in message:
+                    messages = self.batch_events(message['events'])
+                else:
+                    messages = [{key: value for key, value in message.items() if key != 'obj_id'}]
 
-                logging.debug(f"Send message to {json['obj_id']}: {dict_str}")
-                self.send_chunk(self.objects[json['obj_id']].socket, to_be_sent)
+                for to_send in messages:
+                    logging.debug(f"Send message to {obj_id}: {to_send}")
+                    self.send_chunk(self.objects[obj_id].socket, self.encode_message(to_send))
 
         @socketio.on('clean inactive')
         def clean_inactive():
@@ -252,6 +425,8 @@ class DashboardServer:
             if json['obj_id'] in self.objects:
                 self.object_subscriptions[json['obj_id']].remove(json['client_id'])
                 leave_room(json['obj_id'])
+                if request.sid in self.sessions:
+                    self.sessions[request.sid].unsubscribe(json['obj_id'])
 
         @socketio.on('leave')
         def leave(id):
@@ -0,0 +1,229 @@
+import collections
+import itertools
+import logging
+import threading
+import time
+
+
+def payload_size(payload):
+    # Rough size of an update in bytes. Only the bulky parts (strings, tiles) matter here.
+    size = 0
+    for value in payload.values():
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                size += payload_size(item) if isinstance(item, dict) else len(str(item))
+        elif isinstance(value, dict):
+            size += payload_size(value)
+        else:
+            size += 8
+    return size
+
+
+class BrowserSession:
+    # Bytes of updates allowed to wait for a browser before it is considered slow.
+    MAX_QUEUE_BYTES = 8 * 1024 * 1024
+    # Number of updates sent to the browser but not acknowledged yet.
+    MAX_IN_FLIGHT = 4
+    ACK_TIMEOUT = 5
+    # 0: normal, 1: reduced resolution, 2: reduced resolution and rate.
+    MAX_LEVEL = 2
+    REDUCED_RATE_INTERVAL = 1.0
+    LEVEL_HOLD_TIME = 2
+    RECOVER_TIME = 10
+    # A browser that stays congested this long at the lowest level is disconnected.
+    DISCONNECT_TIME = 30
+
+    def __init__(self, sid, client_id):
+        self.sid = sid
+        self.client_id = client_id
+        self.subscriptions = set()
+        self.queue = collections.OrderedDict()
+        self.queued_bytes = 0
+        self.condition = threading.Condition()
+        self.in_flight = threading.Semaphore(self.MAX_IN_FLIGHT)
+        self.in_flight_count = 0
+        self.sent_versions = {}
+        self.level = 0
+        self.level_changed_at = time.time()
+        self.congested_since = None
+        self.closed = False
+        self.sequence = itertools.count()
+
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.replaced_messages = 0
+        self.dropped_messages = 0
+
+    def enqueue(self, object_id, payload, replaceable=True):
+        # payload=None means "send a keyframe built at the time of sending".
+        size = payload_size(payload) if payload is not None else 0
+        with self.condition:
+            if self.closed:
+                return
+
+            if replaceable:
+                key = object_id
+                if key in self.queue:
+                    old_payload, old_size = self.queue[key][1:]
+                    self.queued_bytes -= old_size
+                    self.replaced_messages += 1
+                    if payload is not None and 'base_version' in payload:
+                        # The delta is based on the update we just dropped.
+                        payload, size = None, old_size
+            else:
+                key = (object_id, next(self.sequence))
+
+            # Assigning to an existing key keeps its place in the queue, so an object updated more often
+            # than the browser receives doesn't keep going to the back and starve.
+            self.queue[key] = (object_id, payload, size)
+            self.queued_bytes += size
+
+            if self.queued_bytes > self.MAX_QUEUE_BYTES:
+                self._congested()
+                self._drop_unreplaceable()
+
+            self.condition.notify()
+
+    def enqueue_keyframe(self, object_id):
+        self.enqueue(object_id, None)
+
+    def unsubscribe(self, object_id):
+        with self.condition:
+            self.subscriptions.discard(object_id)
+            for key, (_object_id, _, size) in list(self.queue.items()):
+                if _object_id == object_id:
+                    del self.queue[key]
+                    self.queued_bytes -= size
+            self.sent_versions.pop(object_id, None)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.queue.clear()
+            self.queued_bytes = 0
+            self.condition.notify()
+
+    def _congested(self):
+        now = time.time()
+        if self.congested_since is None:
+            self.congested_since = now
+
+        if self.level < self.MAX_LEVEL and now - self.level_changed_at > self.LEVEL_HOLD_TIME:
+            self.level += 1
+            self.level_changed_at = now
+            logging.info(f"Browser client {self.client_id} is slow, downgrade to level {self.level}. "
+                         f"{len(self.queue)} updates ({self.queued_bytes} bytes) queued.")
+
+    def _drop_unreplaceable(self):
+        # Replaceable updates are bounded by the number of objects. The others (e.g. lines of a rotating log)
+        # pile up, so the oldest ones are dropped.
+        for key in list(self.queue.keys()):
+            if self.queued_bytes <= self.MAX_QUEUE_BYTES:
+                break
+            if isinstance(key, tuple):
+                self.queued_bytes -= self.queue.pop(key)[2]
+                self.dropped_messages += 1
+
+    def _should_disconnect(self):
+        return self.congested_since is not None and self.level == self.MAX_LEVEL \
+            and time.time() - self.congested_since > self.DISCONNECT_TIME
+
+    def _drained(self):
+        now = time.time()
+        self.congested_since = None
+        if self.level and now - self.level_changed_at > self.RECOVER_TIME:
+            self.level -= 1
+            self.level_changed_at = now
+            logging.info(f"Browser client {self.client_id} caught up, upgrade to level {self.level}.")
+
+    def _ack(self, *args):
+        with self.condition:
+            self.in_flight_count -= 1
+        self.in_flight.release()
+
+    def _materialize(self, server, object_id, payload):
+        object = server.objects.get(object_id)
+        if object is None:
+            return payload
+
+        if payload is not None and not object.replaceable:
+            return payload
+
+        if self.level:
+            payload = server.dump_object(object_id, level=self.level)
+            # Deltas can't be applied on top of a reduced frame.
+            self.sent_versions[object_id] = None
+            return payload
+
+        if payload is None or ('base_version' in payload and self.sent_versions.get(object_id) != payload['base_version']):
+            payload = server.dump_object(object_id, keyframe=True)
+
+        self.sent_versions[object_id] = payload['version']
+        return payload
+
+    def run(self, server):
+        while True:
+            if not self.in_flight.acquire(timeout=self.ACK_TIMEOUT):
+                with self.condition:
+                    if self.closed:
+                        return
+                    if self.queue:
+                        self._congested()
+                    disconnect = self._should_disconnect()
+                if disconnect:
+                    break
+                continue
+
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                object_id, payload, size = self.queue.popitem(last=False)[1]
+                self.queued_bytes -= size
+                if not self.queue:
+                    self._drained()
+                disconnect = self._should_disconnect()
+            if disconnect:
+                break
+
+            try:
+                payload = self._materialize(server, object_id, payload)
+            except KeyError:
+                payload = None
+            except Exception:
+                logging.exception(f"Failed to prepare update of {object_id} for browser client {self.client_id}.")
+                payload = None
+            if payload is None:
+                self.in_flight.release()
+                continue
+
+            with self.condition:
+                self.in_flight_count += 1
+            self.sent_messages += 1
+            self.sent_bytes += payload_size(payload)
+            server.socketio.emit('update', payload, room=self.sid, callback=self._ack)
+
+            if self.level == self.MAX_LEVEL:
+                time.sleep(self.REDUCED_RATE_INTERVAL)
+
+        logging.info(f"Browser client {self.client_id} can't keep up with updates, disconnect it.")
+        self.close()
+        server.socketio.server.disconnect(self.sid)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'client_id': self.client_id,
+                'subscriptions': len(self.subscriptions),
+                'queued_messages': len(self.queue),
+                'queued_bytes': self.queued_bytes,
+                'in_flight': self.in_flight_count,
+                'level': self.level,
+                'sent_messages': self.sent_messages,
+                'sent_bytes': self.sent_bytes,
+                'replaced_messages': self.replaced_messages,
+                'dropped_messages': self.dropped_messages,
+            }
@@ -10,8 +10,19 @@ socket.on('id assigned', function (id) {
     console.log("Client id assigned " + id.toString());
     client_id = id;
 });
-socket.on('update', function (json) {
-    updateObject(json);
+socket.on('update', function (json, ack) {
+    try {
+        updateObject(json);
+    } finally {
+        // The server waits for this before sending more, so that a slow browser isn't flooded.
+        // Sent even if rendering failed, or the server would take this browser for a slow one.
+        if (ack) { ack(); }
+    }
+});
+socket.on('query result', function (result) {
+    if (result.id in $objects && $objects[result.id].table) {
+        renderTablePage(result);
+    }
 });
 socket.on('close', function (id) {
     if (id in $objects) {
@@ -30,6 +41,13 @@ var $unsubscribed = [];
 
 var $boardNavItemTemplate = $("#boardNavItemTemplate");
 
+// Renderers of each object type. Plugins add theirs by calling registerRenderer() from their own script.
+var $renderers = {};
+
+function registerRenderer(type, renderer){
+    $renderers[type] = renderer;
+}
+
 function setActiveFlag(id, active=true){
     if(active){
         $objects[id].status.removeClass("text-danger").removeClass("mdi-stop");
@@ -173,15 +191,9 @@ function updateObject(json){
         setActiveFlag(json.id, json.active)
     }
 
-    if (json.type === 'text'){
-        if ($objects[json.id].needInit){ initTextObject(json); $objects[json.id].needInit = false; }
-        updateTextObject(json);
-    }else if (json.type === 'image'){
-        if ($objects[json.id].needInit){ initImageObject(json); $objects[json.id].needInit = false; }
-        updateImageObject(json);
-    }else if (json.type === 'dialog'){
-        if ($objects[json.id].needInit){ initDialogObject(json); $objects[json.id].needInit = false; }
-        updateDialogObject(json);
+    if (json.type in $renderers){
+        if ($objects[json.id].needInit){ $renderers[json.type].init(json); $objects[json.id].needInit = false; }
+        $renderers[json.type].update(json);
     }
 
     if ($objects[json.id].board !== $activeBoard){
@@ -192,6 +204,12 @@ function updateObject(json){
     $objects[json.id].card.show();
 }
 
+registerRenderer('text', { init: initTextObject, update: updateTextObject });
+registerRenderer('image', { init: initImageObject, update: updateImageObject });
+registerRenderer('dialog', { init: initDialogObject, update: updateDialogObject });
+registerRenderer('table', { init: initTableObject, update: updateTableObject });
+registerRenderer('histogram', { init: initHistogramObject, update: updateHistogramObject });
+
 function initTextObject(json){
     $objects[json.id].content.css("max-height", "250px");
     $objects[json.id].content.css("overflow", "auto");
@@ -210,6 +228,14 @@ function updateTextObject(json){
     }
 }
 
+function isRasterFormat(format){
+    return format === "jpeg" || format === "jpg" || format === "png" || format === "gif" || format === "webp";
+}
+
+function isDeltaFormat(format){
+    return format === "jpeg" || format === "jpg" || format === "png" || format === "webp";
+}
+
 function initImageObject(json){
     var format = ($objects[json.id].format =  json.format);
 
@@ -217,7 +243,9 @@ function initImageObject(json){
     $objects[json.id].content.empty();
 
     var img;
-    if (format === "jpeg" || format === "jpg" || format === "png" || format === "gif") {
+    if (isDeltaFormat(format)) {
+        img = $(`<canvas id="${img_id}"></canvas>`);
+    } else if (isRasterFormat(format)) {
         img = $(`<img id="${img_id}"  alt="Image" />`);
     } else if (format === "svg") {
         img = $(`<div id="${img_id}"></div>`);
@@ -226,19 +254,75 @@ function initImageObject(json){
     img.appendTo($objects[json.id].content);
     $objects[json.id].card.resizable({ handles: "n, s" });
     $objects[json.id].img = img;
+    $objects[json.id].imageVersion = null;
+    $objects[json.id].drawing = Promise.resolve();
     $objects[json.id].card.resize(function (){
         console.log($objects[json.id].content.height());
         $objects[json.id].img.height($objects[json.id].content.height());
     });
 }
 
+function loadImage(src){
+    return new Promise(function (resolve, reject) {
+        var image = new Image();
+        image.onload = function () { resolve(image); };
+        image.onerror = reject;
+        image.src = src;
+    });
+}
+
+function drawImageFrame(json){
+    var obj = $objects[json.id];
+    var canvas = obj.img[0];
+
+    if (json.tiles) {
+        if (obj.imageVersion === json.version) {
+            return; // Already drawn, only the active flag has changed.
+        }
+        if (obj.imageVersion !== json.base_version) {
+            // We don't have the frame these tiles apply to, ask for a whole one.
+            obj.imageVersion = null;
+            socket.emit('keyframe', { obj_id: json.id });
+            return;
+        }
+        obj.imageVersion = json.version;
+        var tiles = json.tiles.map(function (tile) {
+            return loadImage(`data:image/png;base64,${tile.data}`);
+        });
+        // Chain the drawing so that tiles never land before the frame they are based on.
+        obj.drawing = obj.drawing.then(function () {
+            return Promise.all(tiles);
+        }).then(function (images) {
+            var ctx = canvas.getContext("2d");
+            images.forEach(function (image, i) {
+                ctx.clearRect(json.tiles[i].x, json.tiles[i].y, json.tiles[i].w, json.tiles[i].h);
+                ctx.drawImage(image, json.tiles[i].x, json.tiles[i].y);
+            });
+        }).catch(function (err) { console.log(err); });
+    } else {
+        obj.imageVersion = json.version;
+        var frame = loadImage(`data:image/${json.format};base64,${json.data}`);
+        obj.drawing = obj.drawing.then(function () {
+            return frame;
+        }).then(function (image) {
+            canvas.width = image.naturalWidth;
+            canvas.height = image.naturalHeight;
+            // A reduced frame is sent when the connection is slow, stretch it to the usual size.
+            obj.img.css("width", json.reduced ? "100%" : "");
+            canvas.getContext("2d").drawImage(image, 0, 0);
+        }).catch(function (err) { console.log(err); });
+    }
+}
+
 function updateImageObject(json){
     if ($objects[json.id].format!== json.format) {
         initImageObject(json);
     }
 
     var format = $objects[json.id].format;
-    if (format === "jpeg" || format === "jpg" || format === "png" || format === "gif") {
+    if (isDeltaFormat(format)) {
+        drawImageFrame(json);
+    } else if (isRasterFormat(format)) {
         $objects[json.id].img.attr("src", `data:image/${format};base64,${json.data}`);
     } else if (format === "svg") {
         $objects[json.id].img.empty();
@@ -314,91 +398,425 @@ var dialogInputTemplate = $(".dialogInputTemplate");
 var dialogButtonTemplate = $(".dialogButtonTemplate");
 var dialogSliderTemplate = $(".dialogSliderTemplate");
 
-function initDialogObject(json){
+// Events are sent in batches, so that a burst of clicks or changes doesn't become a burst of messages.
+var DIALOG_EVENT_BATCH_DELAY = 50;
+
+function queueDialogEvent(obj_id, event, args){
+    var obj = $objects[obj_id];
+    obj.pendingEvents.push({ event: event, args: args });
+    if (!obj.eventTimer) {
+        obj.eventTimer = setTimeout(function () {
+            socket.emit('send', { obj_id: obj_id, events: obj.pendingEvents });
+            obj.pendingEvents = [];
+            obj.eventTimer = null;
+        }, DIALOG_EVENT_BATCH_DELAY);
+    }
+}
+
+function createDialogControl(json, item){
     var dialog_id = "object_dialog_" + json.id;
+    var temp_clone;
+    var control;
+
+    if (item.type === "label"){
+        temp_clone = dialogLabelTemplate.clone();
+        var label = temp_clone.find(".dialogLabel");
+        label.attr("id", dialog_id + "_" + item.name);
+        control = {label: label};
+
+    } else if (item.type === "input") {
+        temp_clone = dialogInputTemplate.clone();
+        var label = temp_clone.find(".dialogLabel");
+        var input = temp_clone.find(".dialogInput");
+        label.attr("id", dialog_id + "_" + item.name + "_label");
+        input.attr("id", dialog_id + "_" + item.name + "_input");
+
+        if (item.handle === 'on_change') {
+            let name = item.name;
+            input.keypress(function (event) {
+                if (event.which === 13) {
+                    queueDialogEvent(json.id, name + "@on_change", this.value);
+                }
+            });
+        }
+
+        control = {label: label, input: input };
+
+    } else if (item.type === "button") {
+        temp_clone = dialogButtonTemplate.clone();
+        var button = temp_clone.find(".dialogButton");
+        button.attr("id", dialog_id + "_" + item.name);
+        if (item.handle === 'on_click') {
+            let name = item.name;
+            button.on('click', function () {
+                queueDialogEvent(json.id, name + "@on_click", '');
+            });
+        }
+        control = {button: button};
+    } else {
+        return;
+    }
+
+    control.item = item;
+    control.elements = temp_clone.children();
+    $objects[json.id].controls[item.name] = control;
+
+    if (item.group in $objects[json.id].groups){
+        control.elements.appendTo($objects[json.id].groups[item.group]);
+    } else {
+        temp_clone.attr("id", dialog_id + "@" + item.group);
+        $objects[json.id].groups[item.group] = temp_clone;
+        temp_clone.appendTo($objects[json.id].content);
+    }
+
+    setDialogControl(json, item);
+}
+
+function setDialogControl(json, item){
+    var control = $objects[json.id].controls[item.name];
+    control.item = item;
+
+    if (item.type === "label"){
+        control.label.html(item.text);
+    } else if (item.type === "input") {
+        control.label.html(item.text);
+        control.input.val(item.value);
+        control.input.prop('disabled', !(item.enabled && json.active));
+    } else if (item.type === "button") {
+        control.button.html(item.text);
+        control.button.prop('disabled', !(item.enabled && json.active));
+    }
+}
+
+function setDialogEnabled(json){
+    // Only the disabled state depends on the active flag, leave texts and what the user is typing alone.
+    for (let name in $objects[json.id].controls) {
+        var control = $objects[json.id].controls[name];
+        if (control.input) {
+            control.input.prop('disabled', !(control.item.enabled && json.active));
+        } else if (control.button) {
+            control.button.prop('disabled', !(control.item.enabled && json.active));
+        }
+    }
+    $objects[json.id].dialogActive = json.active;
+}
+
+function removeDialogControl(json, name){
+    if (name in $objects[json.id].controls) {
+        $objects[json.id].controls[name].elements.remove();
+        delete $objects[json.id].controls[name];
+    }
+}
+
+function initDialogObject(json){
     $objects[json.id].content.empty();
     $objects[json.id].groups = {};
     $objects[json.id].controls = {};
+    $objects[json.id].dialogVersion = null;
+    $objects[json.id].dialogActive = null;
+    if (!$objects[json.id].pendingEvents) {
+        $objects[json.id].pendingEvents = [];
+        $objects[json.id].eventTimer = null;
+    }
+}
 
-
-    for (item of json.fields){
-        var temp_clone;
-
-        if (item.type === "label"){
-            temp_clone = dialogLabelTemplate.clone();
-            var label = temp_clone.find(".dialogLabel");
-            label.attr("id", dialog_id + "_" + item.name);
-            label.html(item.text);
-            $objects[json.id].controls[item.name] = {label: label};
-
-        } else if (item.type === "input") {
-            temp_clone = dialogInputTemplate.clone();
-            var label = temp_clone.find(".dialogLabel");
-            var input = temp_clone.find(".dialogInput");
-            label.attr("id", dialog_id + "_" + item.name + "_label");
-            label.html(item.text);
-            input.attr("id", dialog_id + "_" + item.name + "_input");
-            label.val(item.value);
-
-            if (item.handle === 'on_change') {
-                let name = item.name;
-                input.keypress(function (event) {
-                    if (event.which === 13) {
-                        socket.emit('send', {
-                            obj_id: json.id,
-                            event: name + "@on_change",
-                            args: this.value
-                        })
-                    }
-                });
+function updateDialogObject(json){
+    var obj = $objects[json.id];
+
+    if (json.patch) {
+        if (obj.dialogVersion !== json.version) {
+            if (obj.dialogVersion !== json.base_version) {
+                // We don't have the fields this patch applies to, ask for all of them.
+                socket.emit('keyframe', { obj_id: json.id });
+                return;
             }
-
-            $objects[json.id].controls[item.name] = {label: label, input: input };
-
-        } else if (item.type === "button") {
-            temp_clone = dialogButtonTemplate.clone();
-            var button = temp_clone.find(".dialogButton");
-            button.attr("id", dialog_id + "_" + item.name);
-            button.html(item.text);
-            if (item.handle === 'on_click') {
-                let name = item.name;
-                button.on('click', function () {
-                    socket.emit('send', {
-                        obj_id: json.id,
-                        event: name + "@on_click",
-                        args: ''
-                    })
-                });
+            for (let name of json.patch.remove) {
+                removeDialogControl(json, name);
             }
-            $objects[json.id].controls[item.name] = {button: button};
+            for (let item of json.patch.update) {
+                if (item.name in obj.controls && obj.controls[item.name].item.type !== item.type) {
+                    removeDialogControl(json, item.name);
+                }
+                if (item.name in obj.controls) {
+                    setDialogControl(json, item);
+                } else {
+                    createDialogControl(json, item);
+                }
+            }
+            obj.dialogVersion = json.version;
         }
+        if (obj.dialogActive !== json.active) {
+            setDialogEnabled(json);
+        }
+        return;
+    }
 
-        if (item.group in $objects[json.id].groups){
-            temp_clone.children().appendTo($objects[json.id].groups[item.group]);
-        } else {
-            temp_clone.attr("id", dialog_id + "@" + item.group);
-            $objects[json.id].groups[item.group] = temp_clone;
-            temp_clone.appendTo($objects[json.id].content);
+    var names = json.fields.map(function (item) { return item.name; });
+    var stale = Object.keys(obj.controls).filter(function (name) { return names.indexOf(name) < 0; });
+    var rebuild = stale.length > 0 || json.fields.some(function (item) {
+        return !(item.name in obj.controls) || obj.controls[item.name].item.type !== item.type;
+    });
+
+    if (rebuild) {
+        initDialogObject(json);
+        for (let item of json.fields) {
+            createDialogControl(json, item);
+        }
+    } else {
+        for (let item of json.fields) {
+            setDialogControl(json, item);
         }
     }
+    obj.dialogVersion = json.version;
+    obj.dialogActive = json.active;
 }
 
-function updateDialogObject(json){
-    for (item of json.fields){
-        if (!(item.name in $objects[json.id].controls)){
-            initDialogObject(json);
-            return;
+// ------- Table -------
+
+// Tables are not sent as a whole. The browser asks for the page it shows, sorted and filtered by the server.
+var TABLE_QUERY_DELAY = 200;
+
+function initTableObject(json){
+    var obj = $objects[json.id];
+    obj.content.empty();
+
+    var toolbar = $(`<div class="form-inline mb-2">
+        <select class="form-control form-control-sm mr-1 tableFilterColumn"></select>
+        <select class="form-control form-control-sm mr-1 tableFilterOp">
+            <option value="contains">contains</option>
+            <option value="=">=</option>
+            <option value="!=">&ne;</option>
+            <option value=">">&gt;</option>
+            <option value=">=">&ge;</option>
+            <option value="<">&lt;</option>
+            <option value="<=">&le;</option>
+        </select>
+        <input type="text" class="form-control form-control-sm tableFilterValue" placeholder="Filter">
+    </div>`);
+    var table = $(`<div style="overflow: auto">
+        <table class="table table-sm table-striped">
+            <thead><tr></tr></thead>
+            <tbody></tbody>
+        </table>
+    </div>`);
+    var pager = $(`<div class="d-flex align-items-center">
+        <button type="button" class="btn btn-sm btn-default tablePrev"><span class="mdi mdi-chevron-left"></span></button>
+        <span class="mx-2 tablePageLabel"></span>
+        <button type="button" class="btn btn-sm btn-default tableNext"><span class="mdi mdi-chevron-right"></span></button>
+    </div>`);
+
+    toolbar.appendTo(obj.content);
+    table.appendTo(obj.content);
+    pager.appendTo(obj.content);
+
+    obj.table = {
+        columns: null,
+        view: { page: 0, page_size: 50, sort: null, descending: false, filters: [] },
+        pages: 1,
+        request: 0,
+        timer: null,
+        head: table.find("thead tr"),
+        body: table.find("tbody"),
+        filterColumn: toolbar.find(".tableFilterColumn"),
+        filterOp: toolbar.find(".tableFilterOp"),
+        filterValue: toolbar.find(".tableFilterValue"),
+        pageLabel: pager.find(".tablePageLabel")
+    };
+
+    var applyFilter = function () {
+        var value = obj.table.filterValue.val();
+        obj.table.view.filters = value === "" ? [] : [{
+            column: obj.table.filterColumn.val(),
+            op: obj.table.filterOp.val(),
+            value: value
+        }];
+        obj.table.view.page = 0;
+        requestTablePage(json.id, 0);
+    };
+    obj.table.filterValue.keypress(function (event) {
+        if (event.which === 13) { applyFilter(); }
+    });
+    obj.table.filterColumn.on('change', applyFilter);
+    obj.table.filterOp.on('change', applyFilter);
+
+    pager.find(".tablePrev").on('click', function () {
+        if (obj.table.view.page > 0) {
+            obj.table.view.page -= 1;
+            requestTablePage(json.id, 0);
+        }
+    });
+    pager.find(".tableNext").on('click', function () {
+        if (obj.table.view.page < obj.table.pages - 1) {
+            obj.table.view.page += 1;
+            requestTablePage(json.id, 0);
         }
+    });
+}
+
+function setTableColumns(id, columns){
+    var table = $objects[id].table;
+    table.columns = columns;
+    table.head.empty();
+    table.filterColumn.empty();
+
+    columns.forEach(function (column) {
+        var th = $("<th></th>").text(column.name).css("cursor", "pointer");
+        th.on('click', function () {
+            if (table.view.sort === column.name) {
+                table.view.descending = !table.view.descending;
+            } else {
+                table.view.sort = column.name;
+                table.view.descending = false;
+            }
+            requestTablePage(id, 0);
+        });
+        th.appendTo(table.head);
+        $("<option></option>").text(column.name).attr("value", column.name).appendTo(table.filterColumn);
+    });
+}
+
+function requestTablePage(id, delay){
+    var table = $objects[id].table;
+    // Updates may come faster than we want to ask for pages, so they ask at most once per delay:
+    // a query already waiting will fetch the latest rows anyway. User actions (delay 0) go out at once.
+    if (table.timer !== null) {
+        if (delay) { return; }
+        clearTimeout(table.timer);
+    }
+    table.timer = setTimeout(function () {
+        table.timer = null;
+        table.request += 1;
+        socket.emit('query', Object.assign({ obj_id: id, request: table.request }, table.view));
+    }, delay);
+}
 
-        if (item.type === "label"){
-            $objects[json.id].controls[item.name].label.html(item.text);
-        } else if (item.type === "input") {
-            $objects[json.id].controls[item.name].label.html(item.text);
-            $objects[json.id].controls[item.name].input.val(item.value);
-            $objects[json.id].controls[item.name].input.prop('disabled', !(item.enabled && json.active));
-        } else if (item.type === "button") {
-            $objects[json.id].controls[item.name].button.html(item.text);
-            $objects[json.id].controls[item.name].button.prop('disabled', !(item.enabled && json.active));
+function updateTableObject(json){
+    var table = $objects[json.id].table;
+    if (JSON.stringify(table.columns) !== JSON.stringify(json.columns)) {
+        setTableColumns(json.id, json.columns);
+    }
+    requestTablePage(json.id, TABLE_QUERY_DELAY);
+}
+
+function renderTablePage(result){
+    var table = $objects[result.id].table;
+    if (result.request !== table.request) {
+        return; // An answer to a query we don't care about anymore.
+    }
+    if (result.error) {
+        table.pageLabel.text(result.error);
+        return;
+    }
+
+    table.view.page = result.page;
+    table.pages = result.pages;
+    table.body.empty();
+    result.rows.forEach(function (row) {
+        var tr = $("<tr></tr>");
+        row.forEach(function (value) {
+            $("<td></td>").text(value === null ? "" : value).appendTo(tr);
+        });
+        tr.appendTo(table.body);
+    });
+
+    table.head.children().each(function (i) {
+        var th = $(this);
+        th.find(".mdi").remove();
+        if (table.columns[i].name === table.view.sort) {
+            $(`<span class="mdi ${table.view.descending ? "mdi-arrow-down" : "mdi-arrow-up"}"></span>`).appendTo(th);
+        }
+    });
+    table.pageLabel.text(`Page ${result.page + 1} / ${result.pages} (${result.total} rows)`);
+}
+
+// ------- Histogram -------
+
+// Only the bin counts are sent, the histogram (or the heatmap for 2D) is drawn here.
+var HISTOGRAM_WIDTH = 600;
+var HISTOGRAM_HEIGHT = 300;
+var HISTOGRAM_MARGIN = 30;
+
+function initHistogramObject(json){
+    var obj = $objects[json.id];
+    obj.content.empty();
+    var canvas = $(`<canvas width="${HISTOGRAM_WIDTH}" height="${HISTOGRAM_HEIGHT}"></canvas>`);
+    canvas.css("max-width", "100%");
+    canvas.appendTo(obj.content);
+    obj.histogramCanvas = canvas[0];
+    obj.histogramLabel = $(`<div class="text-muted small"></div>`).appendTo(obj.content);
+}
+
+function formatBound(value){
+    return Number(value.toPrecision(4)).toString();
+}
+
+function heatColor(t){
+    // From dark blue (empty) to yellow (max).
+    var r = Math.round(255 * Math.min(1, Math.max(0, 2 * t - 0.5)));
+    var g = Math.round(255 * Math.min(1, t * 1.2));
+    var b = Math.round(255 * Math.max(0, 0.6 - t));
+    return [r, g, b];
+}
+
+function updateHistogramObject(json){
+    var obj = $objects[json.id];
+    var canvas = obj.histogramCanvas;
+    var ctx = canvas.getContext("2d");
+    var plotWidth = canvas.width - 2 * HISTOGRAM_MARGIN;
+    var plotHeight = canvas.height - 2 * HISTOGRAM_MARGIN;
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+
+    if (!json.bins.length) {
+        // No samples received yet.
+        obj.histogramLabel.text("");
+        return;
+    }
+
+    if (json.bins.length === 1) {
+        var max = Math.max.apply(null, json.counts.concat([1e-9]));
+        var barWidth = plotWidth / json.bins[0];
+        ctx.fillStyle = "#007bff";
+        json.counts.forEach(function (count, i) {
+            var height = plotHeight * count / max;
+            ctx.fillRect(HISTOGRAM_MARGIN + i * barWidth, HISTOGRAM_MARGIN + plotHeight - height,
+                Math.max(1, barWidth - 1), height);
+        });
+        ctx.fillStyle = "#6c757d";
+        ctx.fillText(formatBound(max), 2, HISTOGRAM_MARGIN);
+    } else {
+        // Draw the cells into an image of bins_x * bins_y pixels, then scale it up.
+        var binsX = json.bins[0], binsY = json.bins[1];
+        var max = 1e-9;
+        json.counts.forEach(function (row) { max = Math.max(max, Math.max.apply(null, row)); });
+        var image = ctx.createImageData(binsX, binsY);
+        for (var x = 0; x < binsX; x++) {
+            for (var y = 0; y < binsY; y++) {
+                var color = heatColor(json.counts[x][y] / max);
+                var offset = ((binsY - 1 - y) * binsX + x) * 4; // y axis goes up
+                image.data[offset] = color[0];
+                image.data[offset + 1] = color[1];
+                image.data[offset + 2] = color[2];
+                image.data[offset + 3] = 255;
+            }
         }
+        var cells = document.createElement("canvas");
+        cells.width = binsX;
+        cells.height = binsY;
+        cells.getContext("2d").putImageData(image, 0, 0);
+        ctx.imageSmoothingEnabled = false;
+        ctx.drawImage(cells, HISTOGRAM_MARGIN, HISTOGRAM_MARGIN, plotWidth, plotHeight);
+
+        ctx.fillStyle = "#6c757d";
+        ctx.fillText(formatBound(json.ranges[1][1]), 2, HISTOGRAM_MARGIN + 10);
+        ctx.fillText(formatBound(json.ranges[1][0]), 2, HISTOGRAM_MARGIN + plotHeight);
     }
+
+    ctx.fillStyle = "#6c757d";
+    ctx.textAlign = "left";
+    ctx.fillText(formatBound(json.ranges[0][0]), HISTOGRAM_MARGIN, canvas.height - 10);
+    ctx.textAlign = "right";
+    ctx.fillText(formatBound(json.ranges[0][1]), HISTOGRAM_MARGIN + plotWidth, canvas.height - 10);
+    ctx.textAlign = "left";
+
+    obj.histogramLabel.text(`${formatBound(json.total)} samples, ${formatBound(json.outside)} out of range`);
 }
@@ -0,0 +1,21 @@
+# Images are diffed in square tiles, by clients before sending a frame and by the server before
+# sending it to browsers. Both sides use this, so they agree on where tiles are.
+
+
+def changed_tiles(last_pixels, pixels, size):
+    """
+    :param last_pixels: previous frame, a (height, width, channels) array.
+    :param pixels: current frame, of the same shape.
+    :param size: side of a tile in pixels.
+    :return: (rows, cols) bool array, True for the tiles where any pixel changed.
+    """
+    import numpy as np
+
+    height, width = pixels.shape[:2]
+    # Tiles of the last row and column may be cut by the image border.
+    rows = (height + size - 1) // size
+    cols = (width + size - 1) // size
+
+    diff = np.zeros((rows * size, cols * size), dtype=bool)
+    diff[:height, :width] = (last_pixels != pixels).any(axis=2)
+    return diff.reshape(rows, size, cols, size).any(axis=(1, 3))